@@ -1,9 +1,10 @@
 from __future__ import annotations
-from datetime import datetime
 from typing import List, Optional
+import io
 import os
-import json
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import orjson
 import pandas as pd
 import yfinance as yf
 import requests
@@ -16,6 +17,8 @@ END_DATE: Optional[str] = None     # None = i dag
 LOOKBACK_DAYS = 3                  # Fast 3-dagers retur
 DROP_THRESHOLD = -0.03             # BUY hvis retur <= terskel (f.eks. -3%)
 WEBHOOK_TIMEOUT = 12               # sekunder
+CACHE_PATH = os.path.join(".cache", "prices.parquet")  # Lokal priscache
+CACHE_OVERLAP_DAYS = 10            # Hent halen på nytt (dekker lookback-vinduet)
 # ====================
 
 # >>> WEBHOOK FRA SECRET (ingen fallback) <<<
@@ -23,6 +26,9 @@ DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL", "").strip()
 if not DISCORD_WEBHOOK_URL:
     raise SystemExit("Mangler DISCORD_WEBHOOK_URL (GitHub secret). Avbryter.")
 
+# ALWAYS_SEND=1: send full rapport (tabell + CSV) også når ingen ticker er BUY
+ALWAYS_SEND = os.getenv("ALWAYS_SEND", "").strip() == "1"
+
 TICKERS = [
     "PROT.OL",   # Protector
     "GJF.OL",    # Gjensidige
@@ -49,65 +55,135 @@ def _requests_session_with_retry(total: int = 3) -> requests.Session:
         allowed_methods=frozenset(["POST"]),
         raise_on_status=False,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=8)
     s = requests.Session()
     s.mount("http://", adapter)
     s.mount("https://", adapter)
     return s
 
+# Én delt session for hele prosessen (keep-alive / connection pooling)
+_SESSION = _requests_session_with_retry()
+
+def get_session() -> requests.Session:
+    """Delt HTTP-session brukt av alle webhook-kall."""
+    return _SESSION
+
+def set_session(session: requests.Session) -> None:
+    """Bytt ut delt session (f.eks. i tester)."""
+    global _SESSION
+    _SESSION = session
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+def _post_json(url: str, payload: dict) -> requests.Response:
+    """POST JSON serialisert med orjson (i stedet for requests' stdlib json=)."""
+    return get_session().post(
+        url, data=orjson.dumps(payload), headers=_JSON_HEADERS, timeout=WEBHOOK_TIMEOUT
+    )
+
 # ---------- Data ----------
-def download_adjusted_close(tickers: List[str], start: str, end: Optional[str]) -> pd.DataFrame:
-    """Last adjusted close (auto_adjust=True) til DataFrame [date x ticker]."""
+def _fetch_adjusted_close(tickers: List[str], start, end) -> pd.DataFrame:
+    """Hent adjusted close (auto_adjust=True) fra yfinance til DataFrame [date x ticker]."""
     df = yf.download(
         tickers,
         start=start,
         end=end,
         auto_adjust=True,
         progress=False,
-        group_by="ticker",
+        group_by="column",
         threads=True,
     )
-
-    # Normaliser til én kolonne per ticker (Close er justert når auto_adjust=True)
-    if isinstance(df.columns, pd.MultiIndex):
-        closes = {}
-        for t in tickers:
-            if (t, "Close") in df.columns:
-                closes[t] = df[(t, "Close")].rename(t)
-        if not closes:
-            raise RuntimeError("Ingen prisdata returnert. Sjekk tickere/dato.")
-        prices = pd.concat(closes.values(), axis=1).sort_index()
+    if df.empty or "Close" not in df.columns.get_level_values(0):
+        raise RuntimeError("Ingen prisdata returnert. Sjekk tickere/dato.")
+
+    # Kun Close brukes (justert når auto_adjust=True): kast OHLV rett etter nedlasting.
+    # group_by="column" gir kolonner [felt, ticker], så dette er ett toppnivå-oppslag.
+    prices = df["Close"]
+    if isinstance(prices, pd.Series):
+        # Én ticker uten MultiIndex
+        prices = prices.to_frame(tickers[0])
+    if prices.columns.intersection(tickers).empty:
+        raise RuntimeError("Ingen prisdata returnert. Sjekk tickere/dato.")
+    # Manglende tickere blir NaN-kolonner. Hull fylles i run_scan, kun på halen.
+    return prices.reindex(columns=tickers).sort_index()
+
+def _load_cache(tickers: List[str], start: str) -> Optional[pd.DataFrame]:
+    """Les priscache hvis den finnes og dekker samme tickere og startdato."""
+    if not os.path.exists(CACHE_PATH):
+        return None
+    try:
+        cache = pd.read_parquet(CACHE_PATH)
+    except Exception as e:
+        print(f"Cache: kunne ikke lese {CACHE_PATH}: {e}")
+        return None
+    if cache.empty or list(cache.columns) != list(tickers):
+        return None
+    # Første handelsdag kan ligge etter start (helg/helligdag, f.eks. 1. januar)
+    if cache.index.min() > pd.Timestamp(start) + pd.Timedelta(days=7):
+        return None
+    return cache
+
+def _save_cache(prices: pd.DataFrame) -> None:
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        # float32 halverer cache-størrelsen. Lookback-vinduet hentes uansett
+        # på nytt i float64 (CACHE_OVERLAP_DAYS), så utregningen får full presisjon.
+        prices.astype(np.float32).to_parquet(CACHE_PATH)
+    except Exception as e:
+        print(f"Cache: kunne ikke skrive {CACHE_PATH}: {e}")
+
+def download_adjusted_close(
+    tickers: List[str],
+    start: str,
+    end: Optional[pd.Timestamp],
+    use_cache: bool = True,
+) -> pd.DataFrame:
+    """
+    Last adjusted close til DataFrame [date x ticker].
+    Med cache hentes kun halen (siste CACHE_OVERLAP_DAYS + nye dager) fra yfinance.
+    """
+    cache = _load_cache(tickers, start) if use_cache else None
+    if cache is not None and end is not None and end <= cache.index.max():
+        # Historisk scan (END_DATE før cachens siste dag): full henting i float64,
+        # og den nyere cachen skrives ikke over
+        return _fetch_adjusted_close(tickers, start=start, end=end)
+
+    if cache is None:
+        prices = _fetch_adjusted_close(tickers, start=start, end=end)
     else:
-        # Én ticker-tilfelle
-        prices = df["Close"].to_frame()
-        prices.columns = tickers
-
-    # Dropp rader som er helt tomme og fyll små hull
-    prices = prices.dropna(how="all").ffill()
+        # Feilet nedlasting skal stoppe jobben (ikke kjøre på gammel cache)
+        tail_start = cache.index.max() - pd.Timedelta(days=CACHE_OVERLAP_DAYS)
+        tail = _fetch_adjusted_close(tickers, start=tail_start, end=end)
+        # Nye verdier vinner, men NaN i halen overskriver ikke gode cachede kurser
+        prices = tail.reindex(columns=cache.columns).combine_first(cache).sort_index()
+
+    if use_cache:
+        _save_cache(prices)
     return prices
 
 # ---------- Discord webhook ----------
 def _is_discord(url: str) -> bool:
     return "discord.com/api/webhooks" in (url or "")
 
-def send_generic_webhook(payload: dict, url: str) -> None:
-    s = _requests_session_with_retry()
+# URL-en er fast for prosessen; sjekk én gang ved oppstart
+_IS_DISCORD = _is_discord(DISCORD_WEBHOOK_URL)
+
+def send_generic_webhook(payload: dict, url: str) -> str:
+    """Send rå payload; returnerer statuslinje for logg."""
     try:
-        resp = s.post(url, json=payload, timeout=WEBHOOK_TIMEOUT)
+        resp = _post_json(url, payload)
         if 200 <= resp.status_code < 300:
-            print(f"Webhook (generic): sendt OK ({resp.status_code}).")
-        else:
-            print(f"Webhook (generic): feilet {resp.status_code}: {resp.text[:300]}")
+            return f"Webhook (generic): sendt OK ({resp.status_code})."
+        return f"Webhook (generic): feilet {resp.status_code}: {resp.text[:300]}"
     except Exception as e:
-        print(f"Webhook (generic): unntak: {e}")
+        return f"Webhook (generic): unntak: {e}"
 
 def _build_table_preview(df: pd.DataFrame, max_rows: int = 15) -> str:
     """Kort tabellvisning i code block for Discord."""
     if df.empty:
         return "Ingen data."
-    view = df.copy()
-    view["ticker"] = view["ticker"].astype(str)
-    txt = view.head(max_rows).to_string(index=False)
+    head = df.head(max_rows)
+    txt = head.assign(ticker=head["ticker"].astype(str)).to_string(index=False)
     return f"```\n{txt}\n```"
 
 def send_discord_webhook(
@@ -121,11 +197,15 @@ def send_discord_webhook(
     missing: list[str],
     username: str = "3-Day Scanner",
     avatar_url: Optional[str] = None,
-    attach_csv_path: Optional[str] = None,
-) -> None:
+    csv_bytes: Optional[bytes] = None,
+    csv_name: str = "scan_3day.csv",
+    include_table: bool = True,
+) -> str:
     """
     Sender til Discord med embed + valgfritt CSV-vedlegg.
     Hvis CSV er vedlagt, brukes multipart med 'payload_json' + 'files'.
+    Med include_table=False sendes kun oppsummeringen (ingen tabell).
+    Returnerer statuslinje for logg (skrives ut av kalleren).
     """
     embed_desc = (
         f"**As of:** {as_of}\n"
@@ -137,15 +217,15 @@ def send_discord_webhook(
     if missing:
         embed_desc += f"**Mangler pris:** {', '.join(missing)}\n"
 
-    table_preview = _build_table_preview(df, max_rows=20)
+    fields = [{"name": "Summary", "value": summary[:1000] or "-", "inline": False}]
+    if include_table:
+        table_preview = _build_table_preview(df, max_rows=20)
+        fields.append({"name": "Top rows", "value": table_preview[:1900], "inline": False})
 
     embed = {
         "title": title,
         "description": embed_desc,
-        "fields": [
-            {"name": "Summary", "value": summary[:1000] or "-", "inline": False},
-            {"name": "Top rows", "value": table_preview[:1900], "inline": False},
-        ],
+        "fields": fields,
     }
 
     payload = {
@@ -155,64 +235,87 @@ def send_discord_webhook(
         "embeds": [embed],
     }
 
-    s = _requests_session_with_retry()
-
     # Med vedlegg (CSV)
-    if attach_csv_path and os.path.exists(attach_csv_path):
+    if csv_bytes:
         try:
-            with open(attach_csv_path, "rb") as f:
-                files = {"file": (os.path.basename(attach_csv_path), f, "text/csv")}
-                data = {"payload_json": json.dumps(payload)}
-                resp = s.post(url, data=data, files=files, timeout=WEBHOOK_TIMEOUT)
+            files = {"file": (csv_name, io.BytesIO(csv_bytes), "text/csv")}
+            data = {"payload_json": orjson.dumps(payload).decode()}
+            resp = get_session().post(url, data=data, files=files, timeout=WEBHOOK_TIMEOUT)
         except Exception as e:
-            print(f"Discord webhook: unntak ved filopplasting: {e}")
-            return
+            return f"Discord webhook: unntak ved filopplasting: {e}"
     else:
         # Uten vedlegg
         try:
-            resp = s.post(url, json=payload, timeout=WEBHOOK_TIMEOUT)
+            resp = _post_json(url, payload)
         except Exception as e:
-            print(f"Discord webhook: unntak ved sending: {e}")
-            return
+            return f"Discord webhook: unntak ved sending: {e}"
 
     if 200 <= resp.status_code < 300:
-        print(f"Discord webhook: sendt OK ({resp.status_code}).")
-    else:
-        print(f"Discord webhook: feilet {resp.status_code}: {resp.text[:300]}")
+        return f"Discord webhook: sendt OK ({resp.status_code})."
+    return f"Discord webhook: feilet {resp.status_code}: {resp.text[:300]}"
 
-def send_webhook_auto(data: dict, df: pd.DataFrame, csv_path: Optional[str], url: Optional[str]) -> None:
-    url = (url or "").strip()
+def send_webhook_auto(
+    data: dict,
+    df: pd.DataFrame,
+    url: Optional[str],
+    *,
+    as_of: str = "",
+    summary: str = "",
+    missing: Optional[list[str]] = None,
+    lookback: int = LOOKBACK_DAYS,
+    thresh: float = DROP_THRESHOLD,
+    csv_bytes: Optional[bytes] = None,
+    include_table: bool = True,
+) -> str:
+    """
+    Send til Discord (embed fra nøkkelordargumentene) eller generisk webhook (data som rå payload).
+    url forventes strippet. Returnerer statuslinje for logg.
+    """
     if not url:
-        print("Webhook: ingen URL satt – hopper over sending.")
-        return
+        return "Webhook: ingen URL satt – hopper over sending."
 
-    if _is_discord(url):
+    # Den faste URL-en er allerede klassifisert ved oppstart
+    is_discord = _IS_DISCORD if url == DISCORD_WEBHOOK_URL else _is_discord(url)
+    if is_discord:
         title = "3-Day Return Scan (BUY/HOLD)"
-        send_discord_webhook(
+        return send_discord_webhook(
             url=url,
             title=title,
-            summary=data.get("summary", ""),
+            summary=summary,
             df=df,
-            as_of=data.get("as_of", ""),
-            lookback=data.get("lookback_days", LOOKBACK_DAYS),
-            thresh=data.get("drop_threshold", DROP_THRESHOLD),
-            missing=data.get("missing_last_price", []),
+            as_of=as_of,
+            lookback=lookback,
+            thresh=thresh,
+            missing=missing or [],
             username="Market Scanner",
             avatar_url=None,
-            attach_csv_path=csv_path,
+            csv_bytes=csv_bytes,
+            include_table=include_table,
         )
     else:
-        send_generic_webhook(data, url)
+        # Generisk webhook får ikke CSV-vedlegg: ta med radene i selve payloaden
+        if not df.empty:
+            data = {**data, "results": df.to_dict(orient="records")}
+        return send_generic_webhook(data, url)
 
 # ---------- Scan ----------
+def _classify(close: np.ndarray, ret: np.ndarray, thresh: float) -> np.ndarray:
+    """BUY-maske: gyldig pris, gyldig retur og retur <= terskel (ett vektorisert pass)."""
+    return ~np.isnan(close) & ~np.isnan(ret) & (ret <= thresh)
+
 def run_scan(start: str, end: Optional[str]) -> None:
-    if end is None:
-        end = datetime.today().strftime("%Y-%m-%d")
+    # yfinance tar Timestamp direkte; strengform kun for utskrift/payload
+    end_ts = pd.Timestamp(end).normalize() if end else pd.Timestamp.today().normalize()
+    end_iso = end_ts.date().isoformat()
 
-    print(f"Laster priser fra {start} til {end} (adjusted close)...")
-    prices = download_adjusted_close(TICKERS, start=start, end=end)
+    print(f"Laster priser fra {start} til {end_iso} (adjusted close)...")
+    prices = download_adjusted_close(TICKERS, start=start, end=end_ts)
 
-    prices = prices.loc[prices.index >= pd.to_datetime(start)]
+    # Indeksen er sortert: binærsøk i stedet for boolsk maske over hele historikken
+    prices = prices.iloc[prices.index.searchsorted(pd.Timestamp(start)):]
+
+    # Kun halen trengs til 3-dagers retur: dropp helt tomme rader og fyll små hull bare der
+    prices = prices.iloc[-(LOOKBACK_DAYS + 5):].dropna(how="all").ffill(limit=3)
 
     if len(prices) < LOOKBACK_DAYS + 1:
         print("For lite data til å beregne 3-dagers retur.")
@@ -220,73 +323,98 @@ def run_scan(start: str, end: Optional[str]) -> None:
             "scanner": "3-day return",
             "status": "insufficient_data",
             "start_date": start,
-            "end_date": end,
+            "end_date": end_iso,
             "lookback_days": LOOKBACK_DAYS,
             "drop_threshold": DROP_THRESHOLD,
             "message": "Too few rows to compute 3-day return.",
         }
-        send_webhook_auto(payload, pd.DataFrame(), None, DISCORD_WEBHOOK_URL)
+        print(send_webhook_auto(payload, pd.DataFrame(), DISCORD_WEBHOOK_URL))
         return
 
-    returns_3d = prices.pct_change(LOOKBACK_DAYS, fill_method=None)
-
     last_date = prices.index[-1]
-    last_close = prices.loc[last_date]
-    last_ret = returns_3d.loc[last_date]
-
-    rows = []
-    missing = []
-    for t in TICKERS:
-        r = last_ret.get(t, np.nan)
-        p = last_close.get(t, np.nan)
-        if np.isnan(p):
-            missing.append(t)
-            continue
-        rec = "BUY" if (not np.isnan(r) and r <= DROP_THRESHOLD) else "HOLD"
-        rows.append({
-            "ticker": t,
-            "last_date": last_date.date().isoformat(),
-            "last_close": round(float(p), 4),
-            "ret_3d_%": round(float(r) * 100, 2) if not np.isnan(r) else np.nan,
-            "recommendation": rec
-        })
-
-    df = pd.DataFrame(rows)
-    if not df.empty:
-        df = df.sort_values(by=["ret_3d_%"], ascending=True)
-
-    print("\n== 3-dagers retur og anbefaling ==")
-    if df.empty:
-        print("Ingen data å vise.")
-    else:
-        print(df.to_string(index=False))
-
-    csv_path = "scan_3day.csv"
-    df.to_csv(csv_path, index=False)
-    print(f"\nLagret til {csv_path}")
+    last_date_iso = last_date.date().isoformat()
+    # 3-dagers retur kun for siste rad (ingen full pct_change-ramme), i float64
+    window = prices.iloc[[-1 - LOOKBACK_DAYS, -1]].astype(np.float64)
+    last_close = window.iloc[1]
+    last_ret = pd.Series(
+        last_close.to_numpy() / window.iloc[0].to_numpy() - 1.0,
+        index=prices.columns,
+    )
 
-    if missing:
-        print("\nAdvarsel: Mangler pris på siste dato for:", ", ".join(missing))
+    # Vektorisert klassifisering (ingen Python-løkke per ticker)
+    df = pd.DataFrame(index=pd.Index(TICKERS, name="ticker"))
+    df["last_date"] = last_date_iso
+    df["last_close"] = last_close.reindex(TICKERS)
+    ret = last_ret.reindex(TICKERS)
+    df["ret_3d_%"] = ret * 100
+    buy = _classify(df["last_close"].to_numpy(), ret.to_numpy(), DROP_THRESHOLD)
+    df["recommendation"] = np.where(buy, "BUY", "HOLD")
+
+    missing = df.index[df["last_close"].isna()].tolist()
+    df = df.loc[df["last_close"].notna()]
+    df = df.round({"last_close": 4, "ret_3d_%": 2}).reset_index()
+    # Stigende 3-dagers retur (NaN sist), direkte argsort på underliggende array
+    df = df.take(np.argsort(df["ret_3d_%"].to_numpy(), kind="stable"))
+
+    # Ingen BUY (vanligste tilfelle): hopp over CSV og send kun oppsummering
+    full_report = ALWAYS_SEND or bool((df["recommendation"] == "BUY").any())
+    # Serialiser CSV én gang; samme bytes lastes opp og skrives til disk
+    csv_bytes = df.to_csv(index=False).encode() if full_report else None
 
     summary_text = (
-        f"3-day scan as of {last_date.date().isoformat()} | "
+        f"3-day scan as of {last_date_iso} | "
         f"LOOKBACK={LOOKBACK_DAYS} | THRESH={DROP_THRESHOLD:.4f} | "
         f"tickers={len(TICKERS)} | rows={len(df)}"
     )
     payload = {
         "scanner": "3-day return",
         "status": "ok",
-        "as_of": last_date.date().isoformat(),
+        "as_of": last_date_iso,
         "start_date": start,
-        "end_date": end,
+        "end_date": end_iso,
         "lookback_days": LOOKBACK_DAYS,
         "drop_threshold": DROP_THRESHOLD,
         "missing_last_price": missing,
         "summary": summary_text,
-        "results": df.to_dict(orient="records"),
     }
 
-    send_webhook_auto(payload, df, csv_path, DISCORD_WEBHOOK_URL)
+    # Webhook i bakgrunnen så nettverkslatens overlapper utskrift og CSV-skriving
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(
+            send_webhook_auto,
+            payload, df, DISCORD_WEBHOOK_URL,
+            as_of=last_date_iso,
+            summary=summary_text,
+            missing=missing,
+            lookback=LOOKBACK_DAYS,
+            thresh=DROP_THRESHOLD,
+            csv_bytes=csv_bytes,
+            include_table=full_report,
+        )
+
+        print("\n== 3-dagers retur og anbefaling ==")
+        if df.empty:
+            print("Ingen data å vise.")
+        else:
+            print(df.to_string(index=False))
+
+        csv_path = "scan_3day.csv"
+        if csv_bytes is not None:
+            with open(csv_path, "wb") as f:
+                f.write(csv_bytes)
+            print(f"\nLagret til {csv_path}")
+        else:
+            # Ikke la en CSV fra en tidligere kjøring se ut som dagens resultat
+            if os.path.exists(csv_path):
+                os.remove(csv_path)
+                print(f"\nSlettet gammel {csv_path}.")
+            print("\nIngen BUY-signaler – hopper over CSV (sett ALWAYS_SEND=1 for full rapport).")
+
+        if missing:
+            print("\nAdvarsel: Mangler pris på siste dato for:", ", ".join(missing))
+
+        # Statuslinjen skrives først her, så den ikke havner midt i tabellen
+        print(future.result())
 
 if __name__ == "__main__":
     run_scan(start=START_DATE, end=END_DATE)
@@ -0,0 +1,89 @@
+import importlib.util
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+SCRIPT = Path(__file__).resolve().parents[1] / "best backtester.py"
+TICKERS = ["AAA.OL", "BBB.OL"]
+
+
+@pytest.fixture
+def scanner(monkeypatch, tmp_path):
+    monkeypatch.setenv("DISCORD_WEBHOOK_URL", "https://example.invalid/hook")
+    spec = importlib.util.spec_from_file_location("scanner", SCRIPT)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    monkeypatch.setattr(mod, "CACHE_PATH", os.path.join(tmp_path, "prices.parquet"))
+    return mod
+
+
+def _yf_frame(dates, closes):
+    """Fake yf.download(group_by="column")-resultat: kolonner [felt, ticker]."""
+    idx = pd.DatetimeIndex(pd.to_datetime(dates))
+    cols = pd.MultiIndex.from_product([["Close", "Open"], TICKERS])
+    data = np.column_stack([closes[t] for t in TICKERS] * 2)
+    return pd.DataFrame(data, index=idx, columns=cols)
+
+
+def test_tail_merge_keeps_cached_closes_over_nan(scanner, monkeypatch):
+    full = _yf_frame(
+        ["2024-01-02", "2024-01-03", "2024-01-04"],
+        {"AAA.OL": [10.0, 11.0, 12.0], "BBB.OL": [20.0, 21.0, 22.0]},
+    )
+    tail = _yf_frame(
+        ["2024-01-04", "2024-01-05"],
+        {"AAA.OL": [12.5, 13.0], "BBB.OL": [np.nan, np.nan]},
+    )
+    frames = iter([full, tail])
+    monkeypatch.setattr(scanner.yf, "download", lambda *a, **k: next(frames))
+    end = pd.Timestamp("2024-02-01")
+
+    scanner.download_adjusted_close(TICKERS, start="2024-01-01", end=end)
+    merged = scanner.download_adjusted_close(TICKERS, start="2024-01-01", end=end)
+
+    assert list(merged.columns) == TICKERS
+    assert list(merged.index) == list(pd.to_datetime(
+        ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]))
+    assert merged.loc["2024-01-04", "AAA.OL"] == 12.5
+    assert merged.loc["2024-01-04", "BBB.OL"] == 22.0
+    assert np.isnan(merged.loc["2024-01-05", "BBB.OL"])
+
+    cached = pd.read_parquet(scanner.CACHE_PATH)
+    assert cached.loc["2024-01-04", "BBB.OL"] == 22.0
+
+
+def test_failed_tail_download_propagates(scanner, monkeypatch):
+    full = _yf_frame(["2024-01-02"], {"AAA.OL": [10.0], "BBB.OL": [20.0]})
+    frames = iter([full, pd.DataFrame()])
+    monkeypatch.setattr(scanner.yf, "download", lambda *a, **k: next(frames))
+    end = pd.Timestamp("2024-02-01")
+
+    scanner.download_adjusted_close(TICKERS, start="2024-01-01", end=end)
+    with pytest.raises(RuntimeError):
+        scanner.download_adjusted_close(TICKERS, start="2024-01-01", end=end)
+
+
+def test_end_before_cache_max_skips_cache(scanner, monkeypatch):
+    dates = pd.bdate_range("2024-01-02", "2024-02-20")
+    calls = []
+
+    def fake_download(tickers, start, end, **kwargs):
+        calls.append((pd.Timestamp(start), pd.Timestamp(end)))
+        d = dates[(dates >= pd.Timestamp(start)) & (dates < pd.Timestamp(end))]
+        closes = {t: np.arange(len(d), dtype=float) + 10.0 for t in TICKERS}
+        return _yf_frame(d, closes)
+
+    monkeypatch.setattr(scanner.yf, "download", fake_download)
+    scanner.download_adjusted_close(TICKERS, start="2024-01-01", end=pd.Timestamp("2024-02-21"))
+    cached_before = pd.read_parquet(scanner.CACHE_PATH)
+
+    end = pd.Timestamp("2024-01-15")
+    prices = scanner.download_adjusted_close(TICKERS, start="2024-01-01", end=end)
+
+    assert calls[-1] == (pd.Timestamp("2024-01-01"), end)
+    assert prices.index.max() == pd.Timestamp("2024-01-12")
+    assert prices.dtypes.eq(np.float64).all()
+    pd.testing.assert_frame_equal(pd.read_parquet(scanner.CACHE_PATH), cached_before)
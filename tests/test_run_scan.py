@@ -0,0 +1,86 @@
+import importlib.util
+from pathlib import Path
+
+import orjson
+import pandas as pd
+
+SCRIPT = Path(__file__).resolve().parents[1] / "best backtester.py"
+WEBHOOK_URL = "https://discord.com/api/webhooks/123/abc"
+
+
+class _Response:
+    status_code = 204
+    text = ""
+
+
+class _FakeSession:
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append(kwargs)
+        return _Response()
+
+
+def _flat_download(tickers, start, end, **kwargs):
+    """Fake yf.download(group_by="column") med flate kurser: 0 % retur, alle HOLD."""
+    dates = pd.bdate_range(pd.Timestamp(start), pd.Timestamp(end) - pd.Timedelta(days=1))
+    cols = pd.MultiIndex.from_product([["Close", "Open"], tickers])
+    return pd.DataFrame(100.0, index=dates, columns=cols)
+
+
+def _load_scanner(monkeypatch, tmp_path, always_send):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DISCORD_WEBHOOK_URL", WEBHOOK_URL)
+    if always_send:
+        monkeypatch.setenv("ALWAYS_SEND", "1")
+    else:
+        monkeypatch.delenv("ALWAYS_SEND", raising=False)
+    spec = importlib.util.spec_from_file_location("scanner", SCRIPT)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    monkeypatch.setattr(mod.yf, "download", _flat_download)
+    session = _FakeSession()
+    mod.set_session(session)
+    return mod, session
+
+
+def test_no_buy_sends_summary_only_and_removes_stale_csv(monkeypatch, tmp_path, capsys):
+    scanner, session = _load_scanner(monkeypatch, tmp_path, always_send=False)
+    stale = tmp_path / "scan_3day.csv"
+    stale.write_text("ticker\nOLD.OL\n")
+
+    scanner.run_scan("2024-01-01", "2024-02-01")
+
+    (post,) = session.posts
+    assert "files" not in post
+    payload = orjson.loads(post["data"])
+    field_names = [f["name"] for f in payload["embeds"][0]["fields"]]
+    assert field_names == ["Summary"]
+    assert not stale.exists()
+    assert "Slettet gammel scan_3day.csv" in capsys.readouterr().out
+
+
+def test_always_send_uploads_csv(monkeypatch, tmp_path):
+    scanner, session = _load_scanner(monkeypatch, tmp_path, always_send=True)
+
+    scanner.run_scan("2024-01-01", "2024-02-01")
+
+    (post,) = session.posts
+    name, fh, content_type = post["files"]["file"]
+    assert (name, content_type) == ("scan_3day.csv", "text/csv")
+    csv = pd.read_csv(fh)
+    assert (csv["recommendation"] == "HOLD").all()
+    payload = orjson.loads(post["data"]["payload_json"])
+    assert "Top rows" in [f["name"] for f in payload["embeds"][0]["fields"]]
+    assert (tmp_path / "scan_3day.csv").exists()
+
+
+def test_status_line_printed_after_table(monkeypatch, tmp_path, capsys):
+    scanner, _ = _load_scanner(monkeypatch, tmp_path, always_send=True)
+
+    scanner.run_scan("2024-01-01", "2024-02-01")
+
+    out = capsys.readouterr().out
+    assert out.index("== 3-dagers retur") < out.index("Discord webhook: sendt OK")
+    assert out.rstrip().endswith("Discord webhook: sendt OK (204).")